@@ -1,22 +1,59 @@
                                                     
 from flask import Flask, jsonify, request, make_response, send_from_directory
+import click
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, or_, lambda_stmt, bindparam
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.orm import joinedload
 from flask_jwt_extended import (
     JWTManager, create_access_token, create_refresh_token,
-    jwt_required, get_jwt_identity, get_jwt
+    jwt_required, get_jwt, current_user
 )
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import VerifyMismatchError, InvalidHashError
 from datetime import timedelta
 import os
+import time
+import heapq
+import operator
+from collections import namedtuple
 from functools import wraps
+from threading import Lock
+from cachetools import TTLCache
+import orjson
 from flasgger import Swagger, swag_from
 from flask_cors import CORS
 
 app = Flask(__name__)
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(os.path.abspath(os.path.dirname(__file__)), "catalog.db")
+app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get(
+    "DATABASE_URL",
+    "sqlite:///" + os.path.join(os.path.abspath(os.path.dirname(__file__)), "catalog.db")
+)
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+
+_db_url = make_url(app.config["SQLALCHEMY_DATABASE_URI"])
+if _db_url.get_backend_name() == "sqlite" and _db_url.database in (None, "", ":memory:"):
+    # An in-memory database only exists on its connection, so share one across threads
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "poolclass": StaticPool,
+        "connect_args": {"check_same_thread": False}
+    }
+else:
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_size": 10,
+        "max_overflow": 20,
+        "pool_pre_ping": True,
+        "pool_recycle": 1800
+    }
+    if _db_url.get_backend_name() == "sqlite":
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"]["connect_args"] = {"check_same_thread": False}
 app.config["JWT_SECRET_KEY"] = os.environ.get("JWT_SECRET_KEY", "your-secret-key-here")
 app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(hours=1)
+app.config["SWAGGER"] = {"uiversion": 3}
+# Static files aren't fingerprinted, so cache them briefly and revalidate via ETag
+app.config["SEND_FILE_MAX_AGE_DEFAULT"] = timedelta(seconds=int(os.environ.get("STATIC_MAX_AGE", 3600)))
 
 # Swagger configuration
 swagger_config = {
@@ -48,10 +85,30 @@ swagger_config = {
 # Initialize extensions
 db = SQLAlchemy(app)
 jwt = JWTManager(app)
-swagger = Swagger(app, config=swagger_config)
+
+# API docs are served by the dev server, or by production workers only when
+# ENABLE_DOCS is set, so the flasgger blueprint stays out of the hot path
+swagger = None
+if app.debug or __name__ == "__main__" or os.environ.get("ENABLE_DOCS"):
+    swagger = Swagger(app, config=swagger_config)
+
+# Tune SQLite on every new connection: WAL lets readers run alongside the
+# writer and synchronous=NORMAL avoids an fsync per commit
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.execute("PRAGMA cache_size=-64000")
+    cursor.close()
+
+with app.app_context():
+    if db.engine.dialect.name == "sqlite":
+        event.listen(db.engine, "connect", _set_sqlite_pragmas)
 
 # Enable CORS for all routes and origins
-CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
+CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True, expose_headers=["X-Next-Cursor"])
 
 @app.route('/api/refresh', methods=['POST'])
 @jwt_required(refresh=True)
@@ -76,12 +133,17 @@ def refresh():
         description: Invalid or expired refresh token
     """
     try:
-        current_user = get_jwt_identity()
-        new_access_token = create_access_token(identity=current_user)
+        new_access_token = create_access_token(
+            identity=current_user,
+            additional_claims={"role": current_user.role}
+        )
         return jsonify(access_token=new_access_token), 200
     except Exception as e:
         return jsonify(msg="Token refresh failed", error=str(e)), 401
 
+# Argon2id password hashing (OWASP recommended parameters)
+_ph = PasswordHasher(time_cost=2, memory_cost=47104, parallelism=1)
+
 # User roles
 ROLES = {
     'admin': 'admin',
@@ -91,19 +153,35 @@ ROLES = {
 class User(db.Model):
     __tablename__ = 'users'
     id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(80), unique=True, nullable=False)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(256), nullable=False)
+    username = db.Column(db.String(80), unique=True, nullable=False, index=True)
+    email = db.Column(db.String(120), unique=True, nullable=False, index=True)
+    password_hash = db.Column(db.String(512), nullable=False)
     role = db.Column(db.String(20), nullable=False, default=ROLES['user'])
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = _ph.hash(password)
         
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        # Accounts created before the switch to Argon2 still carry Werkzeug hashes
+        if not self.password_hash.startswith('$argon2'):
+            return check_password_hash(self.password_hash, password)
+        try:
+            return _ph.verify(self.password_hash, password)
+        except (VerifyMismatchError, InvalidHashError):
+            return False
+    
+    def needs_rehash(self):
+        # Legacy Werkzeug hashes, or Argon2 hashes made with older parameters
+        if not self.password_hash.startswith('$argon2'):
+            return True
+        return _ph.check_needs_rehash(self.password_hash)
 
 class Products(db.Model):
     __tablename__ = 'products'
+    # Leads with created_by, so it also serves the ownership lookups by created_by
+    __table_args__ = (
+        db.Index('ix_products_owner_created', 'created_by', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), nullable=False)
     description = db.Column(db.Text)
@@ -112,6 +190,91 @@ class Products(db.Model):
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     updated_at = db.Column(db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
+    # lazy='raise' turns any accidental per-row load into an error instead of an N+1
+    creator = db.relationship('User', lazy='raise')
+
+# Login lookup as a lambda statement so its compiled SQL is cached and reused
+_user_by_name = lambda_stmt(lambda: db.select(User).where(User.username == bindparam("u")))
+
+# Fields returned for a product, read in one attrgetter call per row
+_PROD_KEYS = ('id', 'name', 'description', 'price', 'product_image_url', 'created_by', 'created_at', 'updated_at')
+_prod_get = operator.attrgetter(*_PROD_KEYS)
+
+# The product list is read-only, so it selects Core table columns and gets plain
+# tuples back instead of mapped instances registered in the identity map
+_products_table = Products.__table__
+_users_table = User.__table__
+_LIST_KEYS = _PROD_KEYS + ('creator',)
+_list_columns = [_products_table.c[key] for key in _PROD_KEYS] + [_users_table.c.username]
+# Outer join: SQLite doesn't enforce the foreign key, so a product may outlive its
+# creator; it must still be listed, with creator null
+_list_from = _products_table.outerjoin(_users_table, _products_table.c.created_by == _users_table.c.id)
+
+# Cache of user id -> (id, role) so authenticated requests skip the user SELECT.
+# Nothing changes roles yet; an endpoint that does must pop the user from this cache.
+CachedUser = namedtuple('CachedUser', ['id', 'role'])
+_user_cache = TTLCache(maxsize=10_000, ttl=300)
+_user_cache_lock = Lock()
+
+def _get_user(user_id):
+    with _user_cache_lock:
+        cached = _user_cache.get(user_id)
+    if cached is None:
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        cached = CachedUser(user.id, user.role)
+        with _user_cache_lock:
+            _user_cache[user_id] = cached
+    return cached
+
+# Tokens carry the user id as their identity; current_user resolves it through the cache
+@jwt.user_identity_loader
+def _user_identity(user):
+    return str(user.id)
+
+@jwt.user_lookup_loader
+def _load_user(_jwt_header, jwt_data):
+    try:
+        user_id = int(jwt_data["sub"])
+    except (TypeError, ValueError):
+        # Identity is not a user id, e.g. a token issued before ids were used
+        return None
+    return _get_user(user_id)
+
+# Revoked token JTIs mapped to their exp, each kept until the token would have
+# expired anyway. Entries are only ever dropped once expired, never to make room.
+# This is per process; multi-worker deployments need a shared store such as Redis.
+_REVOKED_MAXSIZE = 100_000
+_revoked = {}
+_revoked_expiry = []  # heap of (exp, jti) used to prune _revoked in expiry order
+_revoked_lock = Lock()
+
+def _revoke_token(jti, exp):
+    """Add a JTI to the blocklist. Returns False if it is full of unexpired entries."""
+    with _revoked_lock:
+        now = time.time()
+        while _revoked_expiry and _revoked_expiry[0][0] <= now:
+            _, expired_jti = heapq.heappop(_revoked_expiry)
+            _revoked.pop(expired_jti, None)
+        if jti not in _revoked and len(_revoked) >= _REVOKED_MAXSIZE:
+            return False
+        _revoked[jti] = exp
+        heapq.heappush(_revoked_expiry, (exp, jti))
+        return True
+
+@jwt.token_in_blocklist_loader
+def _is_token_revoked(_jwt_header, jwt_payload):
+    with _revoked_lock:
+        return jwt_payload["jti"] in _revoked
+
+# Serialize with orjson (native datetime support) instead of the stdlib json encoder
+def _ojson(payload, status=200):
+    return app.response_class(
+        orjson.dumps(payload, option=orjson.OPT_NAIVE_UTC),
+        status=status,
+        mimetype="application/json"
+    )
 
 # Helper function for role-based access
 def role_required(role):
@@ -119,18 +282,22 @@ def role_required(role):
         @wraps(fn)
         @jwt_required()
         def decorator(*args, **kwargs):
-            current_user = User.query.get(get_jwt_identity())
-            if current_user.role != role:
+            if get_jwt().get("role") != role:
                 return jsonify({"msg": "Insufficient permissions"}), 403
             return fn(*args, **kwargs)
         return decorator
     return wrapper
 
-# Initialize the database
-with app.app_context():
+# Initialize the database. This runs from `flask init-db` or the dev server rather
+# than at import, so Gunicorn workers don't race to create the schema and admin.
+def init_db():
     db.create_all()
+    # create_all() skips tables that already exist, so add any missing indexes too
+    for table in (User.__table__, Products.__table__):
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
     # Create admin user if not exists
-    if not User.query.filter_by(username='admin').first():
+    if not db.session.scalar(db.select(User.id).filter_by(username='admin').limit(1)):
         admin = User(
             username='admin',
             email='admin@example.com',
@@ -140,8 +307,13 @@ with app.app_context():
         db.session.add(admin)
         db.session.commit()
 
-@app.route("/", methods=["GET"])
-@swag_from({
+@app.cli.command("init-db")
+def init_db_command():
+    """Create the tables and the default admin user."""
+    init_db()
+    click.echo("Database initialized")
+
+_HOME_SPEC = {
     "responses": {
         "200": {
             "description": "Welcome message",
@@ -153,7 +325,10 @@ with app.app_context():
             }
         }
     }
-})
+}
+
+@app.route("/", methods=["GET"])
+@swag_from(_HOME_SPEC)
 
 def home():
     """Home endpoint
@@ -163,8 +338,7 @@ def home():
     return jsonify({"msg": "Welcome to the Products API!"})
 
 # Auth endpoints
-@app.route("/api/register", methods=["POST"])
-@swag_from({
+_REGISTER_SPEC = {
     "parameters": [
         {
             "name": "body",
@@ -190,7 +364,10 @@ def home():
             "description": "Missing required fields or duplicate username/email"
         }
     }
-})
+}
+
+@app.route("/api/register", methods=["POST"])
+@swag_from(_REGISTER_SPEC)
 def register():
     data = request.get_json()
     
@@ -200,10 +377,17 @@ def register():
         if field not in data or not data[field]:
             return jsonify({"msg": f"{field} is required"}), 400
     
-    # Check if username or email already exists
-    if User.query.filter_by(username=data['username']).first():
-        return jsonify({"msg": "Username already exists"}), 400
-    if User.query.filter_by(email=data['email']).first():
+    # Check if username or email already exists in one query; a username
+    # clash is reported first, as it is the more specific error
+    existing = db.session.execute(
+        db.select(User.username, User.email)
+        .where(or_(User.username == data['username'], User.email == data['email']))
+        .order_by((User.username == data['username']).desc())
+        .limit(1)
+    ).first()
+    if existing:
+        if existing.username == data['username']:
+            return jsonify({"msg": "Username already exists"}), 400
         return jsonify({"msg": "Email already registered"}), 400
         
     user = User(
@@ -218,8 +402,7 @@ def register():
     
     return jsonify({"msg": "User created successfully"}), 201
 
-@app.route("/api/login", methods=["POST"])
-@swag_from({
+_LOGIN_SPEC = {
     "parameters": [
         {
             "name": "body",
@@ -259,16 +442,27 @@ def register():
             "description": "Invalid username or password"
         }
     }
-})
+}
+
+@app.route("/api/login", methods=["POST"])
+@swag_from(_LOGIN_SPEC)
 def login():
     data = request.get_json()
-    user = User.query.filter_by(username=data.get('username')).first()
+    user = db.session.execute(_user_by_name, {"u": data.get('username')}).scalar_one_or_none()
     
     if not user or not user.check_password(data.get('password')):
         return jsonify({"msg": "Invalid username or password"}), 401
+    
+    # Upgrade the stored hash now that the plaintext is known to be correct
+    if user.needs_rehash():
+        user.set_password(data['password'])
+        db.session.commit()
         
-    access_token = create_access_token(identity=user.username)
-    refresh_token = create_refresh_token(identity=user.username)
+    access_token = create_access_token(
+        identity=user,
+        additional_claims={"role": user.role}
+    )
+    refresh_token = create_refresh_token(identity=user)
     
     return jsonify({
         "access_token": access_token,
@@ -281,17 +475,54 @@ def login():
         }
     }), 200
 
-# Product endpoints
-@app.route("/api/products", methods=["GET"])
-@jwt_required(optional=True)
-@swag_from({
+_LOGOUT_SPEC = {
     "parameters": [
         {
             "name": "Authorization",
             "in": "header",
             "type": "string",
+            "required": True,
+            "description": "Bearer {token} (access or refresh token)"
+        }
+    ],
+    "responses": {
+        "200": {
+            "description": "Token revoked"
+        },
+        "401": {
+            "description": "Missing, invalid or already revoked token"
+        },
+        "503": {
+            "description": "Revocation list is full; try again later"
+        }
+    }
+}
+
+@app.route("/api/logout", methods=["POST"])
+@jwt_required(verify_type=False)
+@swag_from(_LOGOUT_SPEC)
+def logout():
+    token = get_jwt()
+    if not _revoke_token(token["jti"], token["exp"]):
+        return jsonify({"msg": "Token revocation temporarily unavailable"}), 503
+    return jsonify({"msg": "Token revoked"}), 200
+
+# Product endpoints
+_GET_PRODUCTS_SPEC = {
+    "parameters": [
+        {
+            "name": "limit",
+            "in": "query",
+            "type": "integer",
             "required": False,
-            "description": "Bearer {token}"
+            "description": "Page size (default 50, max 100)"
+        },
+        {
+            "name": "cursor",
+            "in": "query",
+            "type": "integer",
+            "required": False,
+            "description": "Return products with an id greater than this value (from the X-Next-Cursor header)"
         }
     ],
     "responses": {
@@ -308,6 +539,7 @@ def login():
                         "price": {"type": "number"},
                         "product_image_url": {"type": "string"},
                         "created_by": {"type": "integer"},
+                        "creator": {"type": "string"},
                         "created_at": {"type": "string"},
                         "updated_at": {"type": "string"}
                     }
@@ -315,26 +547,33 @@ def login():
             }
         }
     }
-})
+}
+
+@app.route("/api/products", methods=["GET"])
+@swag_from(_GET_PRODUCTS_SPEC)
 def get_products():
     try:
-        products = Products.query.all()
-        return jsonify([{
-            "id": p.id,
-            "name": p.name,
-            "description": p.description,
-            "price": p.price,
-            "product_image_url": p.product_image_url,
-            "created_by": p.created_by,
-            "created_at": p.created_at.isoformat() if p.created_at else None,
-            "updated_at": p.updated_at.isoformat() if p.updated_at else None
-        } for p in products])
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 100)
+        cursor = request.args.get('cursor', 0, type=int)
+        
+        # Keyset pagination over Core rows
+        stmt = (
+            db.select(*_list_columns)
+            .select_from(_list_from)
+            .where(_products_table.c.id > cursor)
+            .order_by(_products_table.c.id)
+            .limit(limit)
+        )
+        rows = db.session.execute(stmt).all()
+        
+        response = _ojson([dict(zip(_LIST_KEYS, r)) for r in rows])
+        if len(rows) == limit:
+            response.headers["X-Next-Cursor"] = str(rows[-1].id)
+        return response
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route("/api/products/<int:product_id>", methods=["GET"])
-@jwt_required(optional=True)
-@swag_from({
+_GET_PRODUCT_SPEC = {
     "parameters": [
         {
             "name": "product_id",
@@ -355,6 +594,7 @@ def get_products():
                     "price": {"type": "number"},
                     "product_image_url": {"type": "string"},
                     "created_by": {"type": "integer"},
+                    "creator": {"type": "string"},
                     "created_at": {"type": "string"},
                     "updated_at": {"type": "string"}
                 }
@@ -364,23 +604,19 @@ def get_products():
             "description": "Product not found"
         }
     }
-})
+}
+
+@app.route("/api/products/<int:product_id>", methods=["GET"])
+@swag_from(_GET_PRODUCT_SPEC)
 def get_product(product_id):
-    product = Products.query.get_or_404(product_id)
-    return jsonify({
-        "id": product.id,
-        "name": product.name,
-        "description": product.description,
-        "price": product.price,
-        "product_image_url": product.product_image_url,
-        "created_by": product.created_by,
-        "created_at": product.created_at.isoformat() if product.created_at else None,
-        "updated_at": product.updated_at.isoformat() if product.updated_at else None
-    })
+    product = db.session.get(Products, product_id, options=[joinedload(Products.creator)])
+    if product is None:
+        return _ojson({"msg": "Product not found"}, 404)
+    payload = dict(zip(_PROD_KEYS, _prod_get(product)))
+    payload["creator"] = product.creator.username if product.creator else None
+    return _ojson(payload)
 
-@app.route("/api/products", methods=["POST"])
-@jwt_required()
-@swag_from({
+_CREATE_PRODUCT_SPEC = {
     "parameters": [
         {
             "name": "Authorization",
@@ -420,18 +656,19 @@ def get_product(product_id):
             "description": "Unauthorized"
         }
     }
-})
+}
+
+@app.route("/api/products", methods=["POST"])
+@jwt_required()
+@swag_from(_CREATE_PRODUCT_SPEC)
 def create_product():
     data = request.get_json()
-    username = get_jwt_identity()
-    user = User.query.filter_by(username=username).first()
-    
     product = Products(
         name=data['name'],
         description=data.get('description', ''),
         price=data['price'],
         product_image_url=data.get('product_image_url', ''),
-        created_by=user.id
+        created_by=current_user.id
     )
     
     db.session.add(product)
@@ -439,9 +676,7 @@ def create_product():
     
     return jsonify({"msg": "Product created", "id": product.id}), 201
 
-@app.route("/api/products/<int:product_id>", methods=["PUT"])
-@jwt_required()
-@swag_from({
+_UPDATE_PRODUCT_SPEC = {
     "parameters": [
         {
             "name": "Authorization",
@@ -482,15 +717,19 @@ def create_product():
             "description": "Product not found"
         }
     }
-})
+}
+
+@app.route("/api/products/<int:product_id>", methods=["PUT"])
+@jwt_required()
+@swag_from(_UPDATE_PRODUCT_SPEC)
 def update_product(product_id):
     data = request.get_json()
-    username = get_jwt_identity()
-    user = User.query.filter_by(username=username).first()
-    product = Products.query.get_or_404(product_id)
+    product = db.session.get(Products, product_id)
+    if product is None:
+        return _ojson({"msg": "Product not found"}, 404)
     
     # Only allow the creator or admin to update
-    if product.created_by != user.id and user.role != ROLES['admin']:
+    if product.created_by != current_user.id and get_jwt().get("role") != ROLES['admin']:
         return jsonify({"msg": "Not authorized to update this product"}), 403
     
     product.name = data.get('name', product.name)
@@ -501,9 +740,7 @@ def update_product(product_id):
     db.session.commit()
     return jsonify({"msg": "Product updated"})
 
-@app.route("/api/products/<int:product_id>", methods=["DELETE"])
-@jwt_required()
-@swag_from({
+_DELETE_PRODUCT_SPEC = {
     "parameters": [
         {
             "name": "Authorization",
@@ -530,14 +767,18 @@ def update_product(product_id):
             "description": "Product not found"
         }
     }
-})
+}
+
+@app.route("/api/products/<int:product_id>", methods=["DELETE"])
+@jwt_required()
+@swag_from(_DELETE_PRODUCT_SPEC)
 def delete_product(product_id):
-    username = get_jwt_identity()
-    user = User.query.filter_by(username=username).first()
-    product = Products.query.get_or_404(product_id)
+    product = db.session.get(Products, product_id)
+    if product is None:
+        return _ojson({"msg": "Product not found"}, 404)
     
     # Only allow the creator or admin to delete
-    if product.created_by != user.id and user.role != ROLES['admin']:
+    if product.created_by != current_user.id and get_jwt().get("role") != ROLES['admin']:
         return jsonify({"msg": "Not authorized to delete this product"}), 403
     
     db.session.delete(product)
@@ -554,6 +795,8 @@ def serve_static(path):
     return send_from_directory('static', path)
 
 if __name__ == "__main__":
+    with app.app_context():
+        init_db()
     app.run(host="0.0.0.0", port=5001, debug=True)
 
 
@@ -0,0 +1,13 @@
+import os
+
+# Gunicorn settings, picked up automatically by `gunicorn app:app`.
+# Threaded workers let requests overlap while they wait on the database;
+# Flask-SQLAlchemy gives each request its own scoped session.
+bind = os.environ.get("GUNICORN_BIND", "127.0.0.1:5001")
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+
+# SQLite allows a single writer and the token blocklist lives in process
+# memory, so keep one worker by default. Raise GUNICORN_WORKERS when running
+# against PostgreSQL with a shared blocklist.
+workers = int(os.environ.get("GUNICORN_WORKERS", 1))
@@ -177,6 +177,17 @@ function appState() {
         },
         
         logout() {
+            // Revoke both tokens server-side; local state is cleared regardless
+            ['access_token', 'refresh_token'].forEach(key => {
+                const token = localStorage.getItem(key);
+                if (token) {
+                    fetch(`${apiConfig.baseUrl}/logout`, {
+                        method: 'POST',
+                        headers: { 'Authorization': `Bearer ${token}` }
+                    }).catch(error => console.error('Logout error:', error));
+                }
+            });
+            
             // Clear local storage
             localStorage.removeItem('access_token');
             localStorage.removeItem('refresh_token');
@@ -192,13 +203,23 @@ function appState() {
         
         // Product CRUD methods
         fetchProducts() {
-            fetch(`${apiConfig.baseUrl}${apiConfig.endpoints.products}`)
-            .then(response => {
-                if (!response.ok) {
-                    throw new Error(`HTTP error! Status: ${response.status}`);
-                }
-                return response.json();
-            })
+            // The API pages results; follow X-Next-Cursor until the last page
+            const fetchPage = (cursor, collected) => {
+                const query = cursor ? `?cursor=${cursor}` : '';
+                return fetch(`${apiConfig.baseUrl}${apiConfig.endpoints.products}${query}`)
+                .then(response => {
+                    if (!response.ok) {
+                        throw new Error(`HTTP error! Status: ${response.status}`);
+                    }
+                    const nextCursor = response.headers.get('X-Next-Cursor');
+                    return response.json().then(data => {
+                        const products = collected.concat(data);
+                        return nextCursor ? fetchPage(nextCursor, products) : products;
+                    });
+                });
+            };
+            
+            fetchPage(null, [])
             .then(data => {
                 this.products = data;
             })
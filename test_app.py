@@ -1,86 +1,116 @@
 import os
 import pytest
-import tempfile
 import json
+import time
 import uuid
 
-from app import app, db, User, Products, ROLES
+from argon2 import PasswordHasher
+from sqlalchemy import event
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.orm import raiseload, scoped_session, sessionmaker
 
-@pytest.fixture
-def client():
-    # Store original configuration
-    original_db_uri = app.config['SQLALCHEMY_DATABASE_URI']
+# Use an in-memory database; this must be set before app is imported because
+# the engine is built at import time. DATABASE_URL is overridden unconditionally
+# because the fixtures drop all tables.
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+import app as app_module
+from app import app, db, User, Products, ROLES, _user_cache
+
+@pytest.fixture(scope='session')
+def test_users():
+    """Create the schema and test users once for the whole test session"""
     original_testing = app.config.get('TESTING', False)
     original_jwt_key = app.config.get('JWT_SECRET_KEY')
+    original_ph = app_module._ph
     
-    # Create a temporary database file
-    db_fd, db_path = tempfile.mkstemp()
-    
-    # Override app configuration for testing
     app.config['TESTING'] = True
-    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
     app.config['JWT_SECRET_KEY'] = 'test-secret-key'
+    # Cheapest Argon2 profile so the suite doesn't spend its time in the KDF
+    app_module._ph = PasswordHasher(time_cost=1, memory_cost=8, parallelism=1)
     
-    # Create test client
-    test_client = app.test_client()
-    
-    # Create the database and tables
     with app.app_context():
+        assert db.engine.url.database == ':memory:', 'tests must not run against a real database'
+        # pysqlite doesn't emit BEGIN itself, so a SAVEPOINT would open (and its
+        # RELEASE commit) a transaction of its own; take over BEGIN so the
+        # per-test savepoints nest inside a transaction that can be rolled back
+        raw_connection = db.engine.raw_connection()
+        raw_connection.driver_connection.isolation_level = None
+        raw_connection.close()
+        event.listen(db.engine, 'begin', lambda conn: conn.exec_driver_sql('BEGIN'))
         db.drop_all()
         db.create_all()
         
-        # Create test users
+        # Create test users in a single bulk insert
         admin_username = 'admin_test'
         admin_email = f'admin_{uuid.uuid4()}@test.com'
-        
-        admin = User(
-            username=admin_username,
-            email=admin_email,
-            role=ROLES['admin']
-        )
-        admin.set_password('admin123')
-        
         user_username = 'user_test'
         user_email = f'user_{uuid.uuid4()}@test.com'
         
-        user = User(
-            username=user_username,
-            email=user_email,
-            role=ROLES['user']
-        )
-        user.set_password('user123')
-        
-        db.session.add(admin)
-        db.session.add(user)
+        db.session.bulk_insert_mappings(User, [
+            {
+                'username': admin_username,
+                'email': admin_email,
+                'role': ROLES['admin'],
+                'password_hash': app_module._ph.hash('admin123')
+            },
+            {
+                'username': user_username,
+                'email': user_email,
+                'role': ROLES['user'],
+                'password_hash': app_module._ph.hash('user123')
+            }
+        ])
         db.session.commit()
     
-    # Pass admin and user credentials to tests
-    test_client.admin_credentials = {
-        'username': admin_username,
-        'email': admin_email,
-        'password': 'admin123'
-    }
-    
-    test_client.user_credentials = {
-        'username': user_username,
-        'email': user_email,
-        'password': 'user123'
+    yield {
+        'admin': {
+            'username': admin_username,
+            'email': admin_email,
+            'password': 'admin123'
+        },
+        'user': {
+            'username': user_username,
+            'email': user_email,
+            'password': 'user123'
+        }
     }
     
-    yield test_client
-    
-    # Clean up and restore original configuration
     with app.app_context():
         db.session.remove()
         db.drop_all()
     
     app.config['TESTING'] = original_testing
-    app.config['SQLALCHEMY_DATABASE_URI'] = original_db_uri
     app.config['JWT_SECRET_KEY'] = original_jwt_key
+    app_module._ph = original_ph
+
+@pytest.fixture
+def client(test_users):
+    """Test client whose database changes are rolled back after each test"""
+    with app.app_context():
+        connection = db.engine.connect()
+    transaction = connection.begin()
+    
+    # Bind every session opened during the test to this connection; commits
+    # inside the app only release savepoints of the outer transaction
+    original_session = db.session
+    db.session = scoped_session(
+        sessionmaker(bind=connection, join_transaction_mode='create_savepoint')
+    )
+    
+    # Drop cached user lookups left over from previous tests
+    _user_cache.clear()
+    
+    test_client = app.test_client()
+    test_client.admin_credentials = test_users['admin']
+    test_client.user_credentials = test_users['user']
+    
+    yield test_client
     
-    # Close and remove the temporary database
-    os.close(db_fd)
-    os.unlink(db_path)
+    db.session.remove()
+    db.session = original_session
+    transaction.rollback()
+    connection.close()
 
 def get_auth_headers(client, username, password):
     """Helper function to get JWT auth headers"""
@@ -101,6 +131,16 @@ def test_home_endpoint(client):
     assert response.status_code == 200
     assert b"Catalog API is running" in response.data
 
+def test_static_files_cached_and_conditional(client):
+    """Test that static files are cacheable and revalidate with 304"""
+    response = client.get('/static/index.html')
+    assert response.status_code == 200
+    assert response.cache_control.max_age == 3600
+    
+    etag = response.headers['ETag']
+    response = client.get('/static/index.html', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
 def test_register_success(client):
     """Test successful user registration"""
     response = client.post('/api/register', json={
@@ -150,6 +190,17 @@ def test_register_duplicate_username(client):
     assert response.status_code == 400
     assert b"Username already exists" in response.data
 
+def test_register_duplicate_email(client):
+    """Test registration with an email that is already registered"""
+    response = client.post('/api/register', json={
+        'username': f'fresh_{uuid.uuid4().hex[:8]}',
+        'email': client.user_credentials['email'],
+        'password': 'password123'
+    })
+    
+    assert response.status_code == 400
+    assert b"Email already registered" in response.data
+
 def test_login_success(client):
     """Test successful login"""
     response = client.post('/api/login', json={
@@ -172,6 +223,74 @@ def test_login_invalid_credentials(client):
     assert response.status_code == 401
     assert b"Invalid username or password" in response.data
 
+def test_password_hashing_argon2_and_legacy():
+    """Test that new passwords use Argon2 and legacy Werkzeug hashes still verify"""
+    from werkzeug.security import generate_password_hash
+
+    user = User(username='hash_test', email='hash@test.com')
+    user.set_password('secret123')
+    assert user.password_hash.startswith('$argon2')
+    assert user.check_password('secret123')
+    assert not user.check_password('wrong')
+
+    user.password_hash = generate_password_hash('legacy123')
+    assert user.check_password('legacy123')
+    assert not user.check_password('wrong')
+
+def test_logout_revokes_token(client):
+    """Test that a token cannot be used after logout"""
+    headers = get_auth_headers(client, client.user_credentials['username'], client.user_credentials['password'])
+    
+    response = client.post('/api/logout', headers=headers)
+    assert response.status_code == 200
+    assert b"Token revoked" in response.data
+    
+    response = client.post('/api/products', json={
+        'name': 'Revoked Product',
+        'price': 5.00
+    }, headers=headers)
+    assert response.status_code == 401
+
+def test_revoked_tokens_pruned_only_after_expiry(monkeypatch):
+    """Test that revoked JTIs are dropped once expired and kept until then"""
+    monkeypatch.setattr(app_module, '_revoked', {})
+    monkeypatch.setattr(app_module, '_revoked_expiry', [])
+    
+    assert app_module._revoke_token('expired-jti', time.time() - 1)
+    assert app_module._revoke_token('live-jti', time.time() + 3600)
+    
+    assert 'expired-jti' not in app_module._revoked
+    assert 'live-jti' in app_module._revoked
+
+def test_logout_refused_when_blocklist_full(client, monkeypatch):
+    """Test that a full blocklist refuses new revocations instead of evicting"""
+    monkeypatch.setattr(app_module, '_revoked', {})
+    monkeypatch.setattr(app_module, '_revoked_expiry', [])
+    monkeypatch.setattr(app_module, '_REVOKED_MAXSIZE', 1)
+    
+    assert app_module._revoke_token('live-jti', time.time() + 3600)
+    
+    headers = get_auth_headers(client, client.user_credentials['username'], client.user_credentials['password'])
+    response = client.post('/api/logout', headers=headers)
+    assert response.status_code == 503
+    assert list(app_module._revoked) == ['live-jti']
+
+def test_login_upgrades_legacy_hash(client):
+    """Test that logging in replaces a Werkzeug hash with an Argon2 one"""
+    from werkzeug.security import generate_password_hash
+    
+    with app.app_context():
+        user = User.query.filter_by(username=client.user_credentials['username']).first()
+        user.password_hash = generate_password_hash(client.user_credentials['password'])
+        db.session.commit()
+    
+    get_auth_headers(client, client.user_credentials['username'], client.user_credentials['password'])
+    
+    with app.app_context():
+        user = User.query.filter_by(username=client.user_credentials['username']).first()
+        assert user.password_hash.startswith('$argon2')
+        assert user.check_password(client.user_credentials['password'])
+
 # ===== PRODUCT CRUD TESTS =====
 
 def test_get_products_unauthorized(client):
@@ -181,6 +300,107 @@ def test_get_products_unauthorized(client):
     data = json.loads(response.data)
     assert isinstance(data, list)
 
+def test_public_reads_ignore_stale_token(client):
+    """Test that product reads still work when the token's user no longer exists"""
+    headers = get_auth_headers(client, client.user_credentials['username'], client.user_credentials['password'])
+    
+    create_response = client.post('/api/products', json={
+        'name': 'Public Product',
+        'price': 3.00
+    }, headers=get_auth_headers(client, client.admin_credentials['username'], client.admin_credentials['password']))
+    product_id = json.loads(create_response.data)["id"]
+    
+    with app.app_context():
+        User.query.filter_by(username=client.user_credentials['username']).delete()
+        db.session.commit()
+    _user_cache.clear()
+    
+    assert client.get('/api/products', headers=headers).status_code == 200
+    assert client.get(f'/api/products/{product_id}', headers=headers).status_code == 200
+
+def test_get_products_includes_creator(client):
+    """Test that the product list includes the creator's username"""
+    headers = get_auth_headers(client, client.user_credentials['username'], client.user_credentials['password'])
+    
+    client.post('/api/products', json={
+        'name': 'Creator Product',
+        'price': 15.00
+    }, headers=headers)
+    
+    response = client.get('/api/products')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data[-1]["creator"] == client.user_credentials['username']
+
+def test_get_products_lists_orphaned_product(client):
+    """Test that a product whose creator no longer exists is still listed"""
+    with app.app_context():
+        product = Products(name='Orphaned Product', price=7.50, created_by=999)
+        db.session.add(product)
+        db.session.commit()
+        product_id = product.id
+    
+    response = client.get('/api/products')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    orphan = next(p for p in data if p["id"] == product_id)
+    assert orphan["creator"] is None
+    
+    detail = json.loads(client.get(f'/api/products/{product_id}').data)
+    assert detail["creator"] is None
+
+def test_get_product_includes_creator(client):
+    """Test that the product detail has the same creator field as the list"""
+    headers = get_auth_headers(client, client.user_credentials['username'], client.user_credentials['password'])
+    
+    create_response = client.post('/api/products', json={
+        'name': 'Detail Creator Product',
+        'price': 11.00
+    }, headers=headers)
+    product_id = json.loads(create_response.data)["id"]
+    
+    data = json.loads(client.get(f'/api/products/{product_id}').data)
+    assert data["creator"] == client.user_credentials['username']
+    
+    list_data = json.loads(client.get('/api/products').data)
+    assert set(next(p for p in list_data if p["id"] == product_id)) == set(data)
+
+def test_creator_lazy_load_raises(client):
+    """Test that Products.creator must be eager-loaded, so N+1 loads fail loudly"""
+    with app.app_context():
+        product = Products(name='Lazy Product', price=2.00, created_by=1)
+        db.session.add(product)
+        db.session.commit()
+        db.session.expunge_all()
+        
+        product = db.session.execute(
+            db.select(Products).options(raiseload('*')).filter_by(name='Lazy Product')
+        ).scalar_one()
+        with pytest.raises(InvalidRequestError):
+            product.creator
+
+def test_get_products_pagination(client):
+    """Test paging through products with limit and cursor"""
+    headers = get_auth_headers(client, client.admin_credentials['username'], client.admin_credentials['password'])
+    
+    for i in range(3):
+        client.post('/api/products', json={
+            'name': f'Paged Product {i}',
+            'price': 10.00 + i
+        }, headers=headers)
+    
+    first_page = client.get('/api/products?limit=2')
+    assert first_page.status_code == 200
+    first_data = json.loads(first_page.data)
+    assert len(first_data) == 2
+    cursor = first_page.headers["X-Next-Cursor"]
+    assert cursor == str(first_data[-1]["id"])
+    
+    second_page = client.get(f'/api/products?limit=2&cursor={cursor}')
+    second_data = json.loads(second_page.data)
+    assert [p["name"] for p in second_data] == ['Paged Product 2']
+    assert "X-Next-Cursor" not in second_page.headers
+
 def test_create_product_success(client):
     """Test creating a product with authentication"""
     headers = get_auth_headers(client, client.admin_credentials['username'], client.admin_credentials['password'])
@@ -196,6 +416,46 @@ def test_create_product_success(client):
     data = json.loads(response.data)
     assert "id" in data
 
+def test_refresh_token_keeps_role_claim(client):
+    """Test that a refreshed access token still carries the role claim"""
+    login_response = client.post('/api/login', json={
+        'username': client.admin_credentials['username'],
+        'password': client.admin_credentials['password']
+    })
+    refresh_token = json.loads(login_response.data)["refresh_token"]
+    
+    response = client.post('/api/refresh', headers={
+        'Authorization': f'Bearer {refresh_token}'
+    })
+    assert response.status_code == 200
+    access_token = json.loads(response.data)["access_token"]
+    
+    with app.app_context():
+        from flask_jwt_extended import decode_token
+        claims = decode_token(access_token)
+        assert claims["role"] == ROLES['admin']
+        admin_id = User.query.filter_by(username=client.admin_credentials['username']).first().id
+    
+    cached = _user_cache.get(admin_id)
+    assert cached is not None
+    assert cached.role == ROLES['admin']
+
+def test_token_for_deleted_user_rejected(client):
+    """Test that a token whose user no longer exists is rejected"""
+    headers = get_auth_headers(client, client.user_credentials['username'], client.user_credentials['password'])
+    
+    with app.app_context():
+        User.query.filter_by(username=client.user_credentials['username']).delete()
+        db.session.commit()
+    _user_cache.clear()
+    
+    response = client.post('/api/products', json={
+        'name': 'Orphan Product',
+        'price': 5.00
+    }, headers=headers)
+    
+    assert response.status_code == 401
+
 def test_create_product_unauthorized(client):
     """Test creating a product without authentication"""
     response = client.post('/api/products', json={
@@ -273,6 +533,13 @@ def test_delete_product(client):
     # Check that the product is gone
     get_response = client.get(f'/api/products/{product_id}')
     assert get_response.status_code == 404
+    assert b"Product not found" in get_response.data
+    
+    # Updating or deleting it again also reports it missing
+    update_response = client.put(f'/api/products/{product_id}', json={'price': 1.00}, headers=admin_headers)
+    assert update_response.status_code == 404
+    delete_response = client.delete(f'/api/products/{product_id}', headers=admin_headers)
+    assert delete_response.status_code == 404
 
 # ===== RBAC TESTS =====
 